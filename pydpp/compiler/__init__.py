@@ -79,13 +79,15 @@ if __main__ is None or not hasattr(__main__, "__file__") or not __main__.__file_
 
     def collect_errors(tree: Node, problems: ProblemSet,
                        enable_suggestions=False,
-                       semantic_info: ProgramSemanticInfo | None = None):
+                       semantic_info: ProgramSemanticInfo | None = None,
+                       severity: ProblemSeverity | None = None):
         """
         Collects all errors (node/tokens) from a given syntax tree, into a problem set.
         :param tree: the tree with errors
         :param problems: the problem set to add the errors to
         :param enable_suggestions: whether to enable suggestions, attached to the Problem's suggestions attribute
         :param semantic_info: semantic info to use for suggestions
+        :param severity: if given, only collect the problems of this severity
         """
 
         # Make sure that when we enable suggestions, we have some semantic info.
@@ -99,6 +101,10 @@ if __main__ is None or not hasattr(__main__, "__file__") or not __main__.__file_
                 node = stack.pop()
 
                 for p in node.problems:
+                    if severity is not None and p.severity != severity:
+                        # Skip it before computing its span and suggestion.
+                        continue
+
                     if isinstance(p, InnerNodeProblem):
                         # The problem is located on an inner node: use the compute_span function
                         # to get the precise span (since we can specify the *slot* location of the problem)
@@ -1,3 +1,4 @@
+from bisect import bisect_left
 from typing import overload
 
 from pydpp.compiler.syntax import *
@@ -19,7 +20,7 @@ class _Parser:
     It has a similar structure as the tokenizer, with the same cursor system.
     """
 
-    __slots__ = ("tokens", "tok_positions", "cursor", "eof", "eof_token", "eof_idx")
+    __slots__ = ("tokens", "tok_positions", "cursor", "eof", "eof_token", "eof_idx", "reach", "checkpoints")
 
     def __init__(self, tokens: list[Token]):
         if len(tokens) == 0 or tokens[-1].kind != TokenKind.EOF:
@@ -35,18 +36,27 @@ class _Parser:
         "The last token: the end-of-file token."
         self.eof_idx = len(tokens) - 1
         "The index of the EOF token."
+        self.reach = 0
+        "The index of the furthest token we've looked at."
+        self.checkpoints = []
+        """
+        The (statement count, cursor, reach) after each top-level statement, where parsing can resume
+        (see parse_resume).
+        """
 
-    def parse(self):
+    def parse(self, statements: list[Statement] | None = None):
         """
         Parses the list of tokens, and returns the root Program node.
+
+        When resuming, ``statements`` contains the statements already parsed before the cursor.
         """
-        if self.eof:
+        # The list of statements that make up the program.
+        program_statements = statements if statements is not None else []
+
+        if self.eof and not program_statements:
             # We have no tokens! Return an empty program.
             return Program([], leaf(self.eof_token))
 
-        # The list of statements that make up the program.
-        program_statements = []
-
         # Keep track of the sequence of tokens that don't make a valid statement.
         invalid_tokens = []
 
@@ -62,6 +72,9 @@ class _Parser:
                 # Got one! Get rid of the invalid tokens (non-statement) if we got some.
                 flush_invalid_tokens()
                 program_statements.append(stmt)
+                # Here, the parser only knows the cursor and the statements: we can resume from there later,
+                # as long as the tokens we've looked at don't change.
+                self.checkpoints.append((len(program_statements), self.cursor, self.reach))
             else:
                 # That token wasn't recognized as a statement, add it to the unrecognized pile.
                 tkn = self.consume()
@@ -805,9 +818,13 @@ class _Parser:
 
         Can return None if the next token is the EOF token.
         """
-        if self.cursor + skip >= self.eof_idx:
+        i = self.cursor + skip
+        if i >= self.eof_idx:
+            self.reach = self.eof_idx
             return None
-        return self.tokens[self.cursor + skip]
+        if i > self.reach:
+            self.reach = i
+        return self.tokens[i]
 
     def consume(self):
         """
@@ -819,6 +836,8 @@ class _Parser:
 
         # Store the token to return it and advance the cursor by one.
         tok = self.tokens[self.cursor]
+        if self.cursor > self.reach:
+            self.reach = self.cursor
         self.cursor += 1
         self.eof = self.cursor == self.eof_idx
         return tok
@@ -882,3 +901,82 @@ def parse(tokens: list[Token]) -> Program:
     Parses the given list of tokens and returns the root Program node.
     """
     return _Parser(tokens).parse()
+
+
+class ParserState:
+    """
+    What the parser remembers from the last time it parsed a list of tokens, so it can parse it
+    again faster once it's been modified. (See parse_resume)
+    """
+
+    __slots__ = ("tokens", "statements", "problems", "checkpoints")
+
+    def __init__(self, tokens: list[Token], statements: tuple[Statement, ...],
+                 problems: list[tuple[tuple[InnerNode, tuple[InnerNodeProblem, ...]], ...]],
+                 checkpoints: list[tuple[int, int, int]]):
+        self.tokens = tokens
+        "The list of parsed tokens."
+        self.statements = statements
+        "All top-level statements of the program."
+        self.problems = problems
+        "The problems found by the parser in each statement: (node, problems) for every node with problems."
+        self.checkpoints = checkpoints
+        "The (statement count, cursor, reach) after each top-level statement where parsing can resume."
+
+
+def parse_resume(tokens: list[Token], state: ParserState | None) -> tuple[Program, ParserState]:
+    """
+    Parses the given list of tokens like parse does, and returns the root Program node, with the state
+    to give to the next call.
+
+    When given the state of the last call, the statements at the beginning of the program, that only
+    depend on tokens that didn't change, are reused instead of being parsed again.
+    Unchanged tokens must be the same Token objects as last time, like the ones kept by retokenize.
+    Statements that are reused are moved to the new Program node, and only keep the problems
+    found by the parser: problems added later on (by semantic analysis) are removed.
+    """
+    parser = _Parser(tokens)
+    statements = None
+    problems = []
+    if state is not None:
+        # Find the first token that changed since last time.
+        old = state.tokens
+        n = min(len(old), len(tokens))
+        changed = next((i for i in range(n) if old[i] is not tokens[i]), n)
+
+        # Find the last statement that we've parsed without looking at that token or further.
+        # The reach of each checkpoint can only grow, so we can do a binary search.
+        k = bisect_left(state.checkpoints, changed, key=lambda c: c[2])
+        if k > 0:
+            count, cursor, reach = state.checkpoints[k - 1]
+            statements = list(state.statements[:count])
+            problems = state.problems[:count]
+            for s, s_problems in zip(statements, problems):
+                s.register_detachment()
+                if s.has_problems:
+                    # Remove all problems, and put back the ones from the parser.
+                    for node, _ in _find_problems(s):
+                        node.with_problems()
+                    for node, p in s_problems:
+                        node.with_problems(*p)
+            parser.checkpoints = state.checkpoints[:k]
+            parser.reach = reach
+            parser.move(cursor)
+
+    program = parser.parse(statements)
+    problems += (_find_problems(s) for s in program.statements[len(problems):])
+    return program, ParserState(tokens, tuple(program.statements), problems, parser.checkpoints)
+
+
+def _find_problems(node: InnerNode) -> tuple[tuple[InnerNode, tuple[InnerNodeProblem, ...]], ...]:
+    """
+    Returns (node, problems) for every node with problems inside the given node, including itself.
+    """
+    found = []
+    stack = [node] if node.has_problems else []
+    while stack:
+        n = stack.pop()
+        if n.problems:
+            found.append((n, n.problems))
+        stack.extend(c for c in n.child_inner_nodes if c.has_problems)
+    return tuple(found)
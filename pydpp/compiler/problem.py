@@ -160,6 +160,14 @@ class ProblemSet:
         self.problems.append(problem)
         self.grouped[problem.severity].append(problem)
 
+    def clear(self):
+        """
+        Removes all problems from the set, so it can be used again.
+        """
+        self.problems.clear()
+        for group in self.grouped.values():
+            group.clear()
+
     def __iter__(self):
         return iter(self.problems)
 
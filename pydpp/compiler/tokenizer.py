@@ -1,5 +1,6 @@
+from bisect import bisect_right
 from enum import Enum, auto
-from typing import Optional
+from typing import Optional, Callable
 from pydpp.compiler.position import TextSpan
 from pydpp.compiler.problem import ProblemSeverity
 import re
@@ -131,6 +132,18 @@ class TokenKind(Enum):
     It uses the IdentifierToken class.
     That class contains the name attribute."""
 
+    hl_class: str | None
+    """The syntax highlighting class of tokens of this kind, set once for all kinds below:
+    "kw" for keywords and booleans, "str" for strings, "num" for numbers, None for everything else."""
+
+
+for _k in TokenKind:
+    _k.hl_class = ("kw" if _k.name.startswith("KW") or _k == TokenKind.LITERAL_BOOL
+                   else "str" if _k == TokenKind.LITERAL_STRING
+                   else "num" if _k == TokenKind.LITERAL_NUM
+                   else None)
+del _k
+
 
 class TokenProblem:
     """
@@ -202,13 +215,14 @@ class Token:
         - TokenKind.LITERAL_STRING: a string representing the string value
     """
 
-    __slots__ = ("kind", "text", "pre_auxiliary", "full_text", "value", "problems")
+    __slots__ = ("kind", "text", "pre_auxiliary", "full_text", "value", "problems", "offset", "end_offset")
     """Register slots for Token objects to save lots of memory, since we'll have thousands of them.
     Subclasses should also register their own slots!"""
 
     def __init__(self, kind: TokenKind, text: str, pre_auxiliary: tuple[AuxiliaryText, ...] = (),
                  problems: tuple[TokenProblem, ...] = (),
-                 value: str | bool | int | float | None = None):
+                 value: str | bool | int | float | None = None,
+                 offset: int = 0):
         self.kind = kind
         """The kind of the token. See the TokenKind enum for all possible values.
         Tokens of some particular kinds may have additional information, which are stored as supplementary attributes.
@@ -236,6 +250,14 @@ class Token:
         self.problems = problems
         "All problems related to this token."
 
+        self.offset = offset
+        """The index of the token's full text (including auxiliary text) in the tokenized code.
+        Only meaningful for tokens made by the tokenize and retokenize functions."""
+
+        self.end_offset = offset + len(ft)
+        """The index right after the end of the token's text in the tokenized code (exclusive).
+        Only meaningful for tokens made by the tokenize and retokenize functions."""
+
     @property
     def has_problems(self) -> bool:
         return len(self.problems) != 0
@@ -316,14 +338,15 @@ class _Tokenizer:
         "err_start",
         "pending_auxiliary",
         "pending_problems",
-        "no_pending_prob"
+        "no_pending_prob",
+        "token_start"
     )
 
-    def __init__(self, code: str):
+    def __init__(self, code: str, start: int = 0):
         self.code = code
         "The code to tokenize."
 
-        self.eof = len(code) == 0
+        self.eof = start >= len(code)
         "Whether we've reached the end of the file."
 
         self.tokens: list[Token] = []
@@ -331,7 +354,7 @@ class _Tokenizer:
         The list of tokens we have created so far.
         """
 
-        self.cursor = 0
+        self.cursor = start
         """
         The currently read index of the cursor in the code.
         When this is N, the call to peek(1) will yield the N'th character of the code and cursor will be N+1.
@@ -362,18 +385,30 @@ class _Tokenizer:
         Whether pending_problems has zero elements.
         """
 
-    def tokenize(self) -> list[Token]:
+        self.token_start = start
+        """
+        The index where the full text (with auxiliary text) of the next pushed token begins.
+        """
+
+    def tokenize(self, stop: Callable[[int], bool] | None = None) -> list[Token]:
         """
         Tokenizes the code into a sequence of tokens.
         Returns a list of Token objects.
+
+        When stop is given, it is called with the cursor position each time a token is pushed.
+        If it returns True, tokenization stops immediately, and the list is returned without any EOF token.
         """
 
         # First consume any whitespace or comments before checking for end-of-file.
         self.consume_auxiliary()
         while not self.eof:
+            n = len(self.tokens)
+
             # Try to recognize various kinds of tokens.
             # Identifiers come last since they cover any sequence of letters.
-            if self.recognize_kw_sym():  # Recognize a keyword/symbol
+            if self.recognize_simple():  # Recognize common tokens quickly
+                pass
+            elif self.recognize_kw_sym():  # Recognize a keyword/symbol
                 pass
             elif self.recognize_literal():  # Recognize a literal (number, string, bool)
                 pass
@@ -384,12 +419,109 @@ class _Tokenizer:
                 # What do we do with this character? Consume it, mark it as an erroneous character, and move on.
                 self.consume(1, err=True)  # Consume the character and mark it as an error.
 
+            # Right after a token has been pushed, the only state we have is the cursor position:
+            # see if the caller wants us to stop here.
+            if stop is not None and len(self.tokens) != n and stop(self.cursor):
+                return self.tokens
+
         # If still have unrecognized error characters left, don't forget to report the error for those,
         # and add them to the auxiliary text of the last token.
         self.flush_unrecognized_error()
         self.push_token(TokenKind.EOF, "")
         return self.tokens
 
+    simple_regex = re.compile(r"""
+        (?P<aux>(?:\s+|//.*\n)*)
+        (?: (?P<name>(?P<word>[A-Za-z][A-Za-z0-9]*)[A-Za-z0-9_]* | _[A-Za-z0-9_]*)
+          | (?P<num>[0-9]+(?P<dec>\.[0-9]+)?)
+          | (?P<str>"(?:[^"\\]|\\[n"])*")
+          | (?P<sym>==|!=|<=|>=|/(?!/)|[<>+\-*(){};=,]) )
+        """, re.VERBOSE)
+    """The regex used to match the most common tokens in one go, with the whitespace and comments before them:
+    ASCII words and numbers, strings with valid escape sequences, and symbols."""
+
+    aux_regex = re.compile(r"\s+|//.*\n")
+    """The regex used to split auxiliary text matched by simple_regex into whitespace and comments."""
+
+    def recognize_simple(self) -> bool:
+        """
+        Recognizes the most common tokens at once using a single regex, which is way faster than
+        trying every recognize function: keywords, identifiers, booleans, symbols, and numbers and strings
+        that don't need any special handling. Whitespace and comments before the token are consumed too.
+        Gives the same tokens as the other recognize functions, and leaves anything else to them:
+        non-ASCII words, numbers missing their decimal part, unknown escape sequences, unclosed strings,
+        comments at the end of the file...
+        Returns true if a token was recognized, false otherwise.
+        """
+
+        code = self.code
+        m = self.simple_regex.match(code, self.cursor)
+        if m is None:
+            return False
+
+        group = m.lastgroup
+        text = m.group(group)
+        value = None
+
+        # Non-ASCII letters or digits may be part of a word or number: let the other functions deal with that.
+        end = m.end()
+        if (group == "name" or group == "num") and end < len(code) and not code[end].isascii():
+            return False
+
+        if group == "name":
+            # Keywords are made of alphanumeric characters only: "if_a" is the keyword "if" and the identifier "_a"
+            w = m.group("word")
+            if w is not None and (kind := _kw_map.get(w)) is not None:
+                text = w
+            # Booleans don't care about what comes next: "trueish" is the boolean "true" and the identifier "ish".
+            elif w is not None and w.startswith("true"):
+                kind, text, value = TokenKind.LITERAL_BOOL, "true", True
+            elif w is not None and w.startswith("false"):
+                kind, text, value = TokenKind.LITERAL_BOOL, "false", False
+            else:
+                kind = TokenKind.IDENTIFIER
+        elif group == "num":
+            # "5." is missing its decimal part, that's a problem for number_literal to report.
+            if m.group("dec") is None and code.startswith(".", end):
+                return False
+            kind, value = TokenKind.LITERAL_NUM, (int(text) if m.group("dec") is None else float(text))
+        elif group == "str":
+            # The only escape sequences are \" and \n, every backslash begins one.
+            value = text[1:-1]
+            if "\\" in value:
+                value = value.replace('\\"', '"').replace("\\n", "\n")
+            kind = TokenKind.LITERAL_STRING
+        else:
+            kind = _sym_map[text][0]
+
+        # Do what consume and consume_auxiliary do, without calling them for each part.
+        # Unrecognized characters come before the whitespace.
+        if self.err_start is not None:
+            self.flush_unrecognized_error()
+        aux = m.group("aux")
+        self.cursor = m.start(group) + len(text)
+        self.eof = self.cursor >= len(code)
+
+        # Most of the time, the token only has some whitespace before it, and no problems:
+        # make it right away, without going through pending_auxiliary and push_token.
+        if "/" not in aux and self.no_pending_prob and not self.pending_auxiliary:
+            self.tokens.append(Token(kind, text, (AuxiliaryText(AuxiliaryKind.WHITESPACE, aux),) if aux else (),
+                                     (), value, self.token_start))
+            self.token_start = self.cursor
+            return True
+
+        if aux:
+            if "/" not in aux:
+                self.pending_auxiliary.append(AuxiliaryText(AuxiliaryKind.WHITESPACE, aux))
+            else:
+                for a in self.aux_regex.finditer(aux):
+                    t = a.group()
+                    self.pending_auxiliary.append(AuxiliaryText(AuxiliaryKind.SINGLE_LINE_COMMENT if t[0] == "/"
+                                                                else AuxiliaryKind.WHITESPACE, t))
+
+        self.push_token(kind, text, value)
+        return True
+
     def recognize_kw_sym(self) -> bool:
         """
         Recognizes a keyword (KW_XXX) or a symbol (SYM_XXX) in the code.
@@ -401,21 +533,18 @@ class _Tokenizer:
         self.consume_auxiliary()
 
         # Read a sequence of alphanumeric characters. Stop when we hit anything else (symbol/space)
-        i = self.cursor
-        l = 0
-        while i < len(self.code) and self.code[i].isalnum():
-            i += 1
-            l += 1
-            if l > _kw_longest:
-                return False
+        # or when it's longer than any keyword.
+        word = self.kw_regex.match(self.code, self.cursor)
 
         # Did we read at least one alphanumeric character?
-        if i != self.cursor:
-            w = self.code[self.cursor:i]
+        if word is not None:
+            w = word.group()
+            if len(w) > _kw_longest:
+                return False
             # See if it matches a keyword
             m = _kw_map.get(w)
-            if w in _kw_map:
-                self.consume(l)
+            if m is not None:
+                self.consume(len(w))
                 self.push_token(m, w)
                 return True
         else:
@@ -443,6 +572,10 @@ class _Tokenizer:
 
         return False
 
+    kw_regex = re.compile(rf"[^\W_]{{1,{_kw_longest + 1}}}")
+    """The regex used to match a sequence of alphanumeric characters (like str.isalnum), that may be a keyword.
+    It stops after one character more than the longest keyword, we don't need to read further."""
+
     digits_regex = re.compile(r"\d+")
     """The regex used to match a sequence of digits (from 0 to 9)."""
 
@@ -593,11 +726,14 @@ class _Tokenizer:
         Pushes a token to the list of tokens.
         """
         if self.no_pending_prob:
-            self.tokens.append(Token(kind, text, self.flush_auxiliary(), value=value))
+            self.tokens.append(Token(kind, text, self.flush_auxiliary(), value=value, offset=self.token_start))
         else:
             aux = self.flush_auxiliary()
             pb = self.flush_problems(aux)
-            self.tokens.append(Token(kind, text, aux, pb, value))
+            self.tokens.append(Token(kind, text, aux, pb, value, self.token_start))
+
+        # The next token begins right after this one.
+        self.token_start = self.cursor
 
     def flush_auxiliary(self):
         """
@@ -686,6 +822,9 @@ class _Tokenizer:
 
     until_nl_regex = re.compile(r"(.*)\n?")
 
+    whitespace_regex = re.compile(r"\s+")
+    """The regex used to match a sequence of whitespace characters (like str.isspace)."""
+
     def consume_auxiliary(self):
         """
         Consumes all the whitespace characters until the next non-whitespace character,
@@ -703,9 +842,7 @@ class _Tokenizer:
 
             if self.code[i].isspace():
                 # Consume all whitespace characters
-                i += 1
-                while i < l and self.code[i].isspace():
-                    i += 1
+                i = self.whitespace_regex.match(self.code, i).end()
 
                 if i != self.cursor:
                     self.consume(i - self.cursor)
@@ -799,3 +936,87 @@ def tokenize(code: str) -> list[Token]:
     :param code: The code to tokenize.
     """
     return _Tokenizer(code).tokenize()
+
+
+def retokenize(code: str, old_code: str, old_tokens: list[Token]) -> tuple[list[Token], int, int]:
+    """
+    Tokenizes the given code, reusing the tokens of a previous version of that code, so only the tokens
+    around the modified text are created again. Works best with small edits, like someone typing in a text editor.
+
+    Tokenization restarts one token before the modified text, and stops as soon as a token ends at a position
+    where an old token ended too, after the modified text: from there, all the following tokens are the same.
+
+    Returns a tuple (tokens, first, end), with the list of tokens, and the range [first; end[ of tokens
+    in that list that have been created again.
+    The old tokens after the modified text are moved (their offset changes), so old_tokens shouldn't be used anymore.
+
+    :param code: The code to tokenize.
+    :param old_code: The previous version of the code.
+    :param old_tokens: The tokens of the previous version of the code, given by tokenize or retokenize.
+    """
+
+    # Find out which part of the text has been modified: [prefix; len(code)-suffix[ in the new code,
+    # and [prefix; len(old_code)-suffix[ in the old code.
+    prefix = common_prefix_length(code, old_code)
+    if prefix == len(code) == len(old_code):
+        # Nothing changed at all!
+        return old_tokens, 0, 0
+    suffix = common_suffix_length(code, old_code, min(len(code), len(old_code)) - prefix)
+    delta = len(code) - len(old_code)
+    new_edit_end = len(code) - suffix
+
+    # Find the token containing the first modified character, and take the one before it too, since a token
+    # ending right before the modification can become longer (e.g. "ab" -> "abc").
+    first = max(bisect_right(old_tokens, prefix, key=lambda t: t.offset) - 2, 0)
+
+    def stop(cursor: int) -> bool:
+        # We can stop when we're after the modified text, and an old token begins at the same position.
+        if cursor < new_edit_end:
+            return False
+        i = bisect_right(old_tokens, cursor - delta, lo=first, key=lambda t: t.offset) - 1
+        return old_tokens[i].offset == cursor - delta
+
+    tokenizer = _Tokenizer(code, old_tokens[first].offset)
+    new_tokens = tokenizer.tokenize(stop)
+
+    if tokenizer.eof and new_tokens[-1].kind == TokenKind.EOF:
+        # We went to the very end, no old token is kept after the modified text.
+        tail = []
+    else:
+        # Keep all old tokens beginning at the cursor, and move them to their new position.
+        tail = old_tokens[bisect_right(old_tokens, tokenizer.cursor - delta, key=lambda t: t.offset) - 1:]
+        for t in tail:
+            t.offset += delta
+            t.end_offset += delta
+
+    return old_tokens[:first] + new_tokens + tail, first, first + len(new_tokens)
+
+
+def common_prefix_length(a: str, b: str) -> int:
+    """
+    Returns the length of the longest common prefix of a and b.
+    Compares big chunks of text at once, which is way faster than comparing each character in Python.
+    """
+    n = min(len(a), len(b))
+    i = 0
+    step = 1024
+    while step > 0:
+        # Skip chunks of equal text, then try again with smaller chunks.
+        while i + step <= n and a[i:i + step] == b[i:i + step]:
+            i += step
+        step //= 4
+    return i
+
+
+def common_suffix_length(a: str, b: str, limit: int) -> int:
+    """
+    Returns the length of the longest common suffix of a and b, up to limit characters.
+    """
+    la, lb = len(a), len(b)
+    i = 0
+    step = 1024
+    while step > 0:
+        while i + step <= limit and a[la - i - step:la - i] == b[lb - i - step:lb - i]:
+            i += step
+        step //= 4
+    return i
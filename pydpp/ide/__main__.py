@@ -1,18 +1,50 @@
+import logging
 import sys
+import time
 import typing
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import accumulate
 from os import mkdir
 
 import customtkinter as ctk
-from tkinter import filedialog, font
+from tkinter import font, TclError
 import os
-from pydpp.compiler import ProblemSet, ProblemSeverity, collect_errors, analyse, semantic
-from pydpp.compiler.parser import parse
-from pydpp.compiler.tokenizer import tokenize, TokenKind, AuxiliaryKind
+from pydpp.compiler import Problem, ProblemSet, ProblemSeverity, collect_errors, analyse, semantic
+from pydpp.compiler.parser import parse_resume
+from pydpp.compiler.tokenizer import tokenize, retokenize, AuxiliaryKind, common_prefix_length, common_suffix_length
 from pydpp.compiler import compile_code
 import subprocess
 
+HIGHLIGHT_DELAY_MS = 80
+"How long to wait after the last edit before updating the syntax highlighting, in milliseconds."
+HIGHLIGHT_POLL_MS = 10
+"How often to check if the highlighting thread is done analysing the code, in milliseconds."
+ERRORS_DELAY_MS = 400
+"How long to wait after the last edit before looking for errors, in milliseconds. (It needs the parser, which is slow!)"
+
+IDE_DIR = os.path.dirname(os.path.realpath(__file__))
+"The directory of the IDE package, where its metadata is."
+THEME_PATH = os.path.join(IDE_DIR, "Metadata", "style.json")
+"The path to the CustomTkinter theme of the IDE."
+SYNTAX_PATH = os.path.join(IDE_DIR, "..", "..", "Grammary_Draw++.txt")
+"The path to the file describing the Draw++ syntax, shown in the Menu tab."
+PROJECT_DIR = os.path.join(IDE_DIR, "..", "..", "PROJET")
+"The directory the import and save dialogs open in by default."
+
+MONOSPACE_FONTS = ("Cascadia Code", "Consolas", "Ubuntu Mono", "Noto Mono", "Liberation Mono", "Lucida Console")
+"The monospace fonts used for code, by order of preference."
+
+ENABLE_PROFILING = os.getenv("DRAWPP_PROFILE", "0") == "1"
+"Whether to log how long each step of the highlighting takes. Set the DRAWPP_PROFILE environment variable to 1 to enable."
+
+log = logging.getLogger("pydpp.ide")
+if ENABLE_PROFILING:
+    logging.basicConfig(level=logging.DEBUG, format="%(message)s")
+
 ctk.set_appearance_mode("System")
-ctk.set_default_color_theme(os.path.join(os.path.dirname(__file__), 'Metadata/style.json'))
+ctk.set_default_color_theme(THEME_PATH)
 
 
 class App(ctk.CTk):
@@ -74,22 +106,8 @@ class App(ctk.CTk):
         menu.pack(expand=True, fill="both") #let the textbox be visible in "Menu"
         self.textboxes["Menu"] = menu #let the tab be in the dictionnary
 
-        syntax_path = os.path.join(os.path.dirname(__file__), "../../Grammary_Draw++.txt")
-        # Put the entirety of the file in the textbox
-        try:
-            with open(syntax_path, "r", encoding="utf-8") as f:
-                menu.insert("end", f.read())
-        except:
-            print("Failed to load syntax file.")
-            pass
-            # Too bad!
-
-        for f in semantic.builtin_funcs.values():
-            func_sig = f.name + "(" + ", ".join([p.type.value + " " + p.name for p in f.parameters ]) + ")"
-            menu.insert("end", func_sig)
-            if f.doc is not None:
-                menu.insert("end", "\nDocumentation : " + f.doc + "\n")
-            menu.insert("end", "\n")
+        # Fill the Menu once the window is shown, so reading the syntax file doesn't delay it.
+        self.after_idle(self.fill_menu)
 
         menu.configure(state="disabled")    #disable the access to Menu to anyone (if modification to "Menu", first type meu.config(state="normal") and pls replace this line when you're done) 
         self.terminal = ctk.CTkTextbox(self, state="disabled") #creation of the terminal
@@ -101,8 +119,50 @@ class App(ctk.CTk):
         self.newfilecount = 1
         self.tt = ToolTip(self)
 
-    def tidx_to_tkidx(self, idx):
-            return f"1.0+{idx}c"
+        # The font of code textboxes, shared by all of them. Find its family once: listing all fonts is slow.
+        # (Each font has to be updated when the UI scaling changes, so having only one helps too!)
+        self.code_font = ctk.CTkFont(family=find_code_font_family(), size=15)
+
+        # The thread running the tokenizer and the parser for syntax highlighting.
+        # There's only one so updates are analysed one after the other.
+        self.hl_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="highlighting")
+        self.protocol("WM_DELETE_WINDOW", self.close)
+
+    def close(self):
+        """
+        Closes the IDE. Python waits for the highlighting thread before exiting, so throw away
+        the analyses that haven't started yet: only the running one has to finish.
+        """
+        self.hl_executor.shutdown(wait=False, cancel_futures=True)
+        self.destroy()
+
+    def fill_menu(self):
+        """
+        Puts the syntax help and the documentation of all builtin functions in the Menu tab.
+        """
+        # Gather all the text of the Menu first, and put it in the textbox in one go.
+        menu_text = []
+
+        # Put the entirety of the file in the textbox
+        try:
+            with open(SYNTAX_PATH, "r", encoding="utf-8") as f:
+                menu_text.append(f.read())
+        except:
+            print("Failed to load syntax file.")
+            pass
+            # Too bad!
+
+        for f in semantic.builtin_funcs.values():
+            func_sig = f.name + "(" + ", ".join([p.type.value + " " + p.name for p in f.parameters ]) + ")"
+            menu_text.append(func_sig)
+            if f.doc is not None:
+                menu_text.append("\nDocumentation : " + f.doc + "\n")
+            menu_text.append("\n")
+
+        menu = self.textboxes["Menu"]
+        menu.configure(state="normal")
+        menu.insert("end", "".join(menu_text))
+        menu.configure(state="disabled")
 
     def run_program(self, event=None, preview_c_code=False):
         """
@@ -130,8 +190,15 @@ class App(ctk.CTk):
 
         # Compile! Now!
         okay, problems, c_file = compile_code(code, exe_path, c_path)
-
-        # Reads every problem to add a pointer to the error in the code itself
+        tidx_to_tkidx = tkidx_converter(find_line_starts(code))
+
+        # Reads every problem to add a pointer to the error in the code itself.
+        # All messages are written at once, so we need to remember where each link goes in the written text:
+        # (tag, position in the code, start and end of the link in the written text)
+        textbx = self.textboxes[tab_name]
+        lines = []
+        links = []
+        written = 0
         for p in (problems):
 
             # Retrieves info about the error
@@ -139,24 +206,31 @@ class App(ctk.CTk):
                 # We do have position info, let's make a clickable link to see the where the error is.
                 s = p.pos.start
                 e = p.pos.end
-                start, end = self.tidx_to_tkidx(str(s)), self.tidx_to_tkidx(str(e))
+                start, end = tidx_to_tkidx(s), tidx_to_tkidx(e)
                 t = str(s)+"."+str(e)
 
-                # Creates a new tag with a pointer to the error in the code
-                self.terminal.tag_config(t, underline=True, foreground="blue")
-                self.terminal.tag_bind(t, "<Button-1>", lambda event, pos=end: self.get_to_text(textbx, pos))
-                x=len(t) +37
-                x=str(x)+"c"
-                x="end-"+x
-                # Writes to the terminal the error message
-                self.write_to_terminal(f"{p} (double clique pour acceder)")
-                textbx = self.textboxes[self.tabview.get()]
-
-                # Sets the tag to highlight the location of the value
-                self.terminal.tag_add(str(t), x , "end-30c")
+                msg = f"{p} (double clique pour acceder)"
+                # The link is on the position of the error, right before " (double clique pour acceder)".
+                # (Each message begins with a newline, hence the + 1)
+                msg_end = written + 1 + len(msg)
+                links.append((t, end, msg_end - (len(t) + 36), msg_end - 29))
             else:
                 # No position information! (Must be a compile/toolchain error).
-                self.write_to_terminal(f"{p}")
+                msg = f"{p}"
+            lines.append(msg)
+            written += 1 + len(msg)
+
+        # Writes to the terminal all error messages, and remember where they begin.
+        self.terminal.mark_set("problems_start", "end-1c")
+        self.terminal.mark_gravity("problems_start", "left")
+        self.write_to_terminal(*lines)
+
+        for t, end, link_start, link_end in links:
+            # Creates a new tag with a pointer to the error in the code
+            self.terminal.tag_config(t, underline=True, foreground="blue")
+            self.terminal.tag_bind(t, "<Button-1>", lambda event, pos=end: self.get_to_text(textbx, pos))
+            # Sets the tag to highlight the location of the value
+            self.terminal.tag_add(t, f"problems_start+{link_start}c", f"problems_start+{link_end}c")
         
         # The code can be compiled
         if not preview_c_code:
@@ -179,12 +253,13 @@ class App(ctk.CTk):
         txt.see(index)
         txt.focus_force()
 
-    def write_to_terminal(self, text):
+    def write_to_terminal(self, *lines):
         '''
-        Simply writes something to ther terminal
+        Simply writes something to ther terminal, with one line per argument.
+        All lines are written at once, so writing many of them doesn't need as many calls to tkinter.
         '''
         self.terminal.configure(state="normal")
-        self.terminal.insert(ctk.END, f"\n{str(text)}")
+        self.terminal.insert(ctk.END, "".join(f"\n{line}" for line in lines))
         self.terminal.configure(state="disabled")
 
     def delete_terminal(self):
@@ -198,50 +273,82 @@ class App(ctk.CTk):
     def sup_tab(self, event=None):
         tab = self.tabview.get()  # Get current tab
         if tab!="Menu":
-            # Sets tab to previous tab in list, or last if the last one is closed
-            self.tabview.set(list(self.textboxes)[self.tabview.index(tab) + (1 if len(list(self.textboxes)) != self.tabview.index(tab)+1 else -1)])
-            self.tabview.delete(tab)
-            self.textboxes.pop(tab)
+            # Switch to the next tab, or to the previous one if we're closing the last one
+            names = list(self.textboxes)
+            i = names.index(tab)
+            self.tabview.set(names[i + 1] if i + 1 < len(names) else names[i - 1])
+            self.delete_tab(tab)
         else:
             self.write_to_terminal("impossible")
 
     def sup_reptab(self, tab):
         if tab:
             if tab != "Menu":
-                self.tabview.delete(tab)
+                self.delete_tab(tab)
             else:
                 self.write_to_terminal("impossible, nom de l'onglet: 'Menu'")
         else:
             self.write_to_terminal("impossible pas d'onglet")
 
+    def delete_tab(self, tab):
+        """
+        Deletes a tab and its textbox.
+        """
+        txt = self.textboxes.pop(tab)
+        # Put back the original Tcl command of the widget before destroying it: Tcl would keep our command,
+        # and all the analysis data of the textbox with it.
+        untrack_insertions(txt)
+        self.tabview.delete(tab)
+        # Don't update the highlighting of a textbox that doesn't exist anymore.
+        for job in (txt.drawpp_hl_job, txt.drawpp_err_job):
+            if job is not None:
+                txt.after_cancel(job)
+        # Throw away the running updates, and don't run the ones that haven't started yet.
+        txt.drawpp_hl_epoch += 1
+        txt.drawpp_err_epoch += 1
+        for future in (txt.drawpp_hl_future, txt.drawpp_err_future):
+            if future is not None:
+                future.cancel()
+        # Drop the data of the last analyses. Those used by the highlighting thread are dropped there,
+        # once it's done with the update it may be running.
+        txt.drawpp_code = txt.drawpp_hl_text = None
+        txt.drawpp_error_infos = []
+        self.hl_executor.submit(forget_analysis, txt)
+
     def sauv_event(self, event=None):
         tab = self.tabview.get()  # Get current oppened tab
         if tab != "Menu":
             textbox = self.textboxes.get(tab)  # Get corresponding Textbox
             if textbox:
                 text = textbox.get("1.0", "end-1c")  # Get Textbox content
+                # Dialogs are only needed when saving or importing: no need to import them with the IDE.
+                from tkinter import filedialog
                 file = filedialog.asksaveasfilename(
                     defaultextension="*.dpp",
                     filetypes=[("dpp","*.dpp")],
+                    initialdir=PROJECT_DIR,
                     initialfile=((tab + ".dpp") if not tab.endswith(".dpp") else tab)
                     )
                 filename = os.path.basename(file)
                 if file:
-                    with open(file, "w") as f:
+                    with open(file, "w", encoding="utf-8") as f:
                         f.write(text)
                     if filename != tab:
+                        # Another tab has the same name? Replace it.
                         if filename in self.textboxes:
                             self.sup_reptab(filename)
+                            if filename in self.textboxes:
+                                return  # It's the Menu, we can't replace it
                         self.tabview.rename(tab, filename)
-                        self.textboxes[filename] = self.textboxes[tab]
-                        self.textboxes.pop(tab)
+                        self.textboxes[filename] = self.textboxes.pop(tab)
                         self.tabview.set(filename)
 
     def imp_event(self, event=None):
+        from tkinter import filedialog
         file = filedialog.askopenfilename(title="Importer",
                                         defaultextension="*.dpp",
                                         filetypes=[("dpp","*.dpp")],
-                                        initialdir= r"PROJET", # Mettre un r pour faire la diférence entre \ en tant que signe spécial et \ pour un caractère lambda
+                                        initialdir=PROJECT_DIR,
                                         )   
         if file:    
             file_name=os.path.basename(file)
@@ -249,10 +356,22 @@ class App(ctk.CTk):
                 pass  # File is already oppened
             else:
                 self.new_tab(file_name)
-                fichier = open(file, "r")
-                lecture = fichier.readlines()
-                for line in lecture:
-                    self.textboxes[file_name].insert("end", line)
+                # Read the whole file at once, and close it right after.
+                # Invalid UTF-8 sequences are replaced instead of crashing the import.
+                with open(file, "r", encoding="utf-8", errors="replace") as fichier:
+                    data = fichier.read()
+                txt = self.textboxes[file_name]
+                txt.insert("1.0", data)
+
+                # The imported text is where undoing should stop, not an edit on an empty file:
+                # the undo stack would keep a copy of the whole file, and undoing would clear the textbox.
+                txt.edit_reset()
+
+                # Highlight the code and find errors right now: no need to wait for more edits.
+                # Mark the text as unmodified so the <<Modified>> event of the insertion is ignored.
+                txt.edit_modified(False)
+                self.update_highlighting(txt)
+                self.update_errors(txt)
 
     def new_tab(self, name: str = None, event=None):
         if not name:
@@ -281,25 +400,9 @@ class App(ctk.CTk):
             # Initialize color tags
             self.init_highlighting(showtext)
             # Bind the Modified event to update the syntax highlighting on type/paste/delete/etc.
-            showtext.bind("<<Modified>>", lambda e: self.update_highlighting(showtext))
+            showtext.bind("<<Modified>>", partial(self.text_modified, showtext))
             # Change font of textbox because existing one is UGLY
-            # Try all monospace fonts I know so it works on both Windows and Linux.
-            fonts = font.families()
-            if "Cascadia Code" in fonts:
-                fam = "Cascadia Code"
-            elif "Consolas" in fonts:
-                fam = "Consolas"
-            elif "Ubuntu Mono" in fonts:
-                fam = "Ubuntu Mono"
-            elif "Noto Mono" in fonts:
-                fam = "Noto Mono"
-            elif "Liberation Mono" in fonts:
-                fam = "Liberation Mono"
-            elif "Lucida Console" in fonts:
-                fam = "Lucida Console"
-            else:
-                fam = fonts[0]
-            showtext.configure(font=ctk.CTkFont(family=fam, size=15))
+            showtext.configure(font=self.code_font)
 
             self.textboxes[name] = showtext
             self.tabview.set(name)
@@ -312,6 +415,15 @@ class App(ctk.CTk):
         txt.tag_config("cmt", foreground="#93a1a1")
         txt.tag_config("err", underline=True, underlinefg="red")
 
+        # Find out where text is inserted, so we can highlight it again.
+        # Keep the name of the original Tcl command of the widget: Tcl scripts can use it directly.
+        setattr(txt, "drawpp_edits", 0)
+        setattr(txt, "drawpp_tk_command", track_insertions(txt))
+
+        # The text of the textbox, and the number of edits made when it was read (see get_code).
+        setattr(txt, "drawpp_code", None)
+        setattr(txt, "drawpp_code_edits", -1)
+
         def err_enter(er):
 
             # The cursor is on the error. Let's find the err_info_{i} tag, and grab that i value
@@ -351,16 +463,23 @@ class App(ctk.CTk):
                         while root.parent is not None:
                             root = root.parent
 
+                        # The errors are analysed a while after the text changes, so this problem may come from
+                        # an older tree: applying it would throw away everything typed since then.
+                        # Also, the highlighting thread may be using the tree right now (see analyse_errors).
+                        # In both cases, the errors are going to be updated soon: just wait for them.
+                        future = txt.drawpp_err_future
+                        if (future is not None and not future.done()) or root.full_text != get_code(txt):
+                            return
+
                         # Apply the suggestion
                         pb_sug.apply(real_problem.node)
+                        # The tree has changed, so the errors we found in it can't be reused (see analyse_errors).
+                        # That attribute belongs to the highlighting thread: forget them there, before the next update.
+                        self.hl_executor.submit(setattr, txt, "drawpp_err_text", None)
 
-                        # Replace the ENTIRETY of the code with the one modified by the suggestion.
-                        # Keep the cursor as it was before.
-                        cursor = txt.index("insert")
-                        txt.delete("1.0", "end")
-                        txt.insert("1.0", root.full_text)
-                        txt.mark_set("insert", cursor)
-                        txt.see(cursor)
+                        # Replace the code with the one modified by the suggestion.
+                        # Only the modified part is replaced, so the rest keeps its tags, and the cursor stays put.
+                        replace_text(txt, root.full_text)
 
                         # Make sure the file is reparsed correctly.
                         txt.edit_modified(True)
@@ -396,94 +515,253 @@ class App(ctk.CTk):
         # ==> drawpp_error_infos[i] = problem data for text with tag "err_info_{i}"
         setattr(txt, "drawpp_error_infos", [])
 
-    def update_highlighting(self, txt: ctk.CTkTextbox):
-        # Converts a string index into tkinter coordinates
-        def tidx_to_tkidx(idx):
-            return f"1.0+{idx}c"
+        # The id of the pending highlighting update (see schedule_highlighting), None when there's none,
+        # and when the last update began (with time.monotonic).
+        setattr(txt, "drawpp_hl_job", None)
+        setattr(txt, "drawpp_hl_time", 0.0)
+
+        # The last analysis submitted to the highlighting thread, for highlighting and for errors.
+        setattr(txt, "drawpp_hl_future", None)
+        setattr(txt, "drawpp_err_future", None)
+
+        # The number of the last highlighting update that began, and of the last one that has been applied.
+        setattr(txt, "drawpp_hl_epoch", 0)
+        setattr(txt, "drawpp_hl_applied", 0)
+
+        # The text highlighted by the last update that has been applied.
+        setattr(txt, "drawpp_hl_text", None)
+
+        # Same for error updates: the id of the pending one (see schedule_errors), and the number of the last one.
+        setattr(txt, "drawpp_err_job", None)
+        setattr(txt, "drawpp_err_epoch", 0)
+
+        # Attributes used by the highlighting thread only (see analyse_highlighting):
+        # - the text and tokens from the last analysis, so we only have to tokenize
+        #   the modified text on the next update. (None when we haven't tokenized anything yet)
+        # - the (start, end) range of text with new tokens, None if there's none
+        # - the number of the last analysed update
+        # - the state of the parser after the last error update (see analyse_errors)
+        # - the text and errors from the last error update
+        # - the problem set used to collect errors, reused on each error update
+        setattr(txt, "drawpp_text", None)
+        setattr(txt, "drawpp_tokens", None)
+        setattr(txt, "drawpp_dirty", None)
+        setattr(txt, "drawpp_hl_analysed", 0)
+        setattr(txt, "drawpp_parse_state", None)
+        setattr(txt, "drawpp_err_text", None)
+        setattr(txt, "drawpp_errors", None)
+        setattr(txt, "drawpp_problems", ProblemSet())
+
+        # Only the visible text is highlighted, so highlight the rest when it's scrolled into view.
+        # The yscrollcommand of the text widget is called whenever the visible text changes (scrolling,
+        # resizing, editing...); CTkTextbox already uses it for its scrollbar, so call its command too.
+        scroll_command = txt.tk.splitlist(txt._textbox.cget("yscrollcommand"))
+        def scrolled(*args):
+            if scroll_command:
+                txt.tk.call(scroll_command + args)
+            self.text_scrolled(txt)
+        txt._textbox.configure(yscrollcommand=scrolled)
+
+    def text_modified(self, txt: ctk.CTkTextbox, event=None):
+        """
+        Called when the text of the textbox is modified; updates the highlighting soon.
+        """
+        # Setting modified to False triggers <<Modified>> too! Ignore that one.
+        if not txt.edit_modified():
+            return
 
-        # Clear all existing highlighting
-        for tag in txt.tag_names(): # tag_names() returns all tags in the textbox
-            txt.tag_remove(tag, "1.0", "end")
+        # Set modified to False now so the event triggers again on the next edit
+        # (it's dumb but that's how it works)
+        txt.edit_modified(False)
 
-        # Reset errors we've saved before
-        txt.drawpp_error_infos = []
+        self.schedule_highlighting(txt)
+        self.schedule_errors(txt)
 
-        # Close the tooltip if it's opened.
-        self.tt.destroy()
+    def text_scrolled(self, txt: ctk.CTkTextbox):
+        """
+        Called when the visible text of the textbox changes; updates the highlighting soon
+        if some of it isn't highlighted yet.
+        """
+        # Editing often changes the view too. Don't schedule another update while the one for that edit
+        # is still running: that would throw its result away (see apply_highlighting).
+        # The view is checked again once it's applied.
+        if txt.drawpp_hl_applied != txt.drawpp_hl_epoch:
+            return
+
+        first, last = visible_lines(txt)
+        if txt._textbox.tag_nextrange("hl_todo", f"{first}.0", f"{last + 1}.0"):
+            self.schedule_highlighting(txt)
 
+    def schedule_highlighting(self, txt: ctk.CTkTextbox):
+        """
+        Schedules a highlighting update for the textbox, in a few milliseconds.
+        When the text is modified again before that, the pending update is cancelled and rescheduled,
+        so a burst of keystrokes only runs the tokenizer once.
+        The first edit after a while is highlighted right away though, so single keystrokes don't lag behind.
+        """
+        # Cancel the update that's still waiting, we're going to schedule a new one.
+        if txt.drawpp_hl_job is not None:
+            txt.after_cancel(txt.drawpp_hl_job)
+        elif (time.monotonic() - txt.drawpp_hl_time) * 1000 >= HIGHLIGHT_DELAY_MS:
+            # Nothing happened lately: this isn't a burst of keystrokes (yet).
+            self.update_highlighting(txt)
+            return
+
+        def run():
+            txt.drawpp_hl_job = None
+            self.update_highlighting(txt)
+
+        txt.drawpp_hl_job = txt.after(HIGHLIGHT_DELAY_MS, run)
+
+    def update_highlighting(self, txt: ctk.CTkTextbox):
+        """
+        Updates the syntax highlighting of the visible text of the textbox.
+        The code is analysed on the highlighting thread (see analyse_highlighting), so the IDE doesn't freeze
+        while the tokenizer runs. Tags are then applied on the main thread, once the analysis is done.
+        """
         # Get the entire text of the textbox
-        code_text = txt.get("1.0", "end")
+        code_text = get_code(txt)
+        # Get all text left to highlight: inserted text (see track_insertions),
+        # and text that wasn't visible during the last updates.
+        todo = [str(i) for i in txt._textbox.tag_ranges("hl_todo")]
+
+        # Nothing to do if the text is already highlighted, like when an edit is undone before the update.
+        # (Only when no other update is running: its result would be applied on the text we have now!)
+        if not todo and code_text == txt.drawpp_hl_text and txt.drawpp_hl_applied == txt.drawpp_hl_epoch:
+            return
 
-        # Run the tokenizer (for primary syntax highlighting)
-        tkn_list = profile("tokenize", lambda: tokenize(code_text))
+        # Give a number to this update: results from older updates will be thrown away.
+        txt.drawpp_hl_time = time.monotonic()
+        txt.drawpp_hl_epoch += 1
+        epoch = txt.drawpp_hl_epoch
+
+        # The previous update is outdated now. If it's still waiting for the highlighting thread, don't run it.
+        # (Its modified text will be highlighted by this update, see analyse_highlighting)
+        if txt.drawpp_hl_future is not None:
+            txt.drawpp_hl_future.cancel()
+        future = self.hl_executor.submit(analyse_highlighting, txt, code_text, todo, visible_lines(txt),
+                                         epoch, txt.drawpp_hl_applied)
+        txt.drawpp_hl_future = future
+
+        # Check regularly if the analysis is done. We can't apply the tags from the highlighting thread,
+        # since tkinter must only be used on the main thread.
+        def wait():
+            if future.cancelled():
+                return
+            if future.done():
+                self.apply_highlighting(txt, epoch, code_text, future.result())
+            else:
+                txt.after(HIGHLIGHT_POLL_MS, wait)
+
+        txt.after(HIGHLIGHT_POLL_MS, wait)
+
+    def apply_highlighting(self, txt: ctk.CTkTextbox, epoch: int, code_text: str, result: "HighlightResult"):
+        """
+        Applies the tags found by analyse_highlighting on the textbox.
+        """
+        # Has the text been modified since the update began? Then the result is outdated,
+        # and a new update is coming (or is already running) with the new text.
+        if epoch != txt.drawpp_hl_epoch or txt.drawpp_hl_job is not None or txt.edit_modified():
+            return
+        txt.drawpp_hl_applied = epoch
+        txt.drawpp_hl_text = code_text
 
-        # Highlight every portion of the text that matches with a token
+        # Highlight every visible portion of the text that matches with a new token.
+        # Tags of the other tokens are still correct, since tkinter moves them along with the text.
         s = profile_start("highlighting")
-        start = 0
-        keywords = {x for x in TokenKind if x.name.startswith("KW") or x == TokenKind.LITERAL_BOOL}
-        for t in tkn_list:
-            # First look at auxiliary text to highlight comments
-            for a in t.pre_auxiliary:
-                l = len(a.text)
-                if a.kind == AuxiliaryKind.SINGLE_LINE_COMMENT:
-                    # Comment
-                    txt.tag_add("cmt", tidx_to_tkidx(start), tidx_to_tkidx(start + l))
-                start += l
-
-            l = len(t.text)
-            if t.kind in keywords:
-                # Keyword
-                txt.tag_add("kw", tidx_to_tkidx(start), tidx_to_tkidx(start + l))
-            elif t.kind == TokenKind.LITERAL_STRING:
-                # String
-                txt.tag_add("str", tidx_to_tkidx(start), tidx_to_tkidx(start + l))
-            elif t.kind == TokenKind.LITERAL_NUM:
-                # Number
-                txt.tag_add("num", tidx_to_tkidx(start), tidx_to_tkidx(start + l))
-            start += l
+        if result.dirty is not None:
+            # Clear the highlighting of the new tokens' text
+            for tag in ("kw", "str", "num", "cmt"):
+                remove_tag(txt, tag, *result.dirty)
+
+        for tag, indices in result.spans.items():
+            add_tag(txt, tag, indices)
+
+        # Remember the text we haven't highlighted because it's not visible.
+        remove_tag(txt, "hl_todo", "1.0", "end")
+        add_tag(txt, "hl_todo", result.todo)
         profile_end(s)
+        log.debug("---")
+
+        # The view may have changed during the update, highlight what's visible now if needed.
+        self.text_scrolled(txt)
+
+    def schedule_errors(self, txt: ctk.CTkTextbox):
+        """
+        Schedules an update of the errors underlined in the textbox, like schedule_highlighting does.
+        Finding errors needs the parser, which is way slower than the tokenizer, so we wait a bit longer:
+        errors are only updated when the user stops typing.
+        """
+        if txt.drawpp_err_job is not None:
+            txt.after_cancel(txt.drawpp_err_job)
+
+        def run():
+            txt.drawpp_err_job = None
+            self.update_errors(txt)
+
+        txt.drawpp_err_job = txt.after(ERRORS_DELAY_MS, run)
+
+    def update_errors(self, txt: ctk.CTkTextbox):
+        """
+        Updates the errors underlined in the textbox.
+        Just like update_highlighting, the code is analysed on the highlighting thread (see analyse_errors).
+        """
+        txt.drawpp_err_epoch += 1
+        epoch = txt.drawpp_err_epoch
+
+        if txt.drawpp_err_future is not None:
+            txt.drawpp_err_future.cancel()
+        future = self.hl_executor.submit(analyse_errors, txt, get_code(txt))
+        txt.drawpp_err_future = future
+
+        def wait():
+            if future.cancelled():
+                return
+            if future.done():
+                self.apply_errors(txt, epoch, future.result())
+            else:
+                txt.after(HIGHLIGHT_POLL_MS, wait)
 
-        # Now, let's parse the tree to find any errors; and do semantic analysis for bonus errors
-        tree = profile("parse", lambda: parse(tkn_list))
-        semantic = profile("semantic", lambda: analyse(tree))
+        txt.after(HIGHLIGHT_POLL_MS, wait)
+
+    def apply_errors(self, txt: ctk.CTkTextbox, epoch: int, errors: list[tuple[str, str, Problem]]):
+        """
+        Underlines the errors found by analyse_errors in the textbox.
+        """
+        # Is the result outdated? (See apply_highlighting)
+        if epoch != txt.drawpp_err_epoch or txt.drawpp_err_job is not None or txt.edit_modified():
+            return
+
+        s = profile_start("error highlighting")
+        # Each error has its own tag, so we can't add or remove them all with one tag_add/tag_remove call:
+        # make a Tcl script doing it instead, to call Tcl only once.
+        cmd = txt.drawpp_tk_command
+        script = [f"{cmd} tag remove err 1.0 end"]
+
+        # Clear all existing error highlighting. The last update used the err_info_{i} tags
+        # for each of its errors: those tag names are reused for the new errors.
+        script += (f"{cmd} tag remove err_info_{i} 1.0 end" for i in range(len(txt.drawpp_error_infos)))
+
+        # Reset errors we've saved before
+        txt.drawpp_error_infos = []
+
+        # Close the tooltip if it's opened.
+        self.tt.destroy()
 
         # Highlight every error (not warnings for now)
-        s = profile_start("error finding")
-        ps = ProblemSet()
-        # Collect all errors from the tree, and put them all in the problem set
-        collect_errors(tree, ps, True, semantic)
-        i = 0
-        for e in ps.grouped[ProblemSeverity.ERROR]:
-            # When the span is of zero-length, extend it on the right by one character to indicate something
-            # that is "missing".
-            ps, pe = e.pos.start, e.pos.end
-            if ps == pe:
-                if pe < len(code_text) and code_text[pe] != "\n":
-                    pe = pe + 1
-                else:
-                    # Tkinter doesn't support highlighting at the very end of line.
-                    # So, in this case, let's just extend to the left.
-                    ps = ps - 1
-
-            # Convert coordinates to tkinter coordinates
-            start, end = tidx_to_tkidx(ps), tidx_to_tkidx(pe)
-
-            # Add the "err" tag for red underlining
-            txt.tag_add("err", start, end)
+        err_indices = []
+        for i, (start, end, e) in enumerate(errors):
+            # Add the "err" tag for red underlining (all at once, later)
+            err_indices += start, end
 
             # Add the "err_info_{i}" tag used for fetching the problem info (description),
             # and add the problem in a drawpp_error_infos list.
-            txt.tag_add(f"err_info_{i}", start, end)
+            script.append(f"{cmd} tag add err_info_{i} {start} {end}")
             txt.drawpp_error_infos.append(e)
-            i += 1
+        txt.tk.eval("\n".join(script))
+        add_tag(txt, "err", err_indices)
         profile_end(s)
 
-        if ENABLE_PROFILING:
-            print("---")
-
-        # Set modified to False so the event triggers again (it's dumb but that's how it works)
-        txt.edit_modified(False)
-
     def change_appearance_mode(self, new_appearance_mode: str):
         ctk.set_appearance_mode(new_appearance_mode)
 
@@ -509,8 +787,8 @@ class ToolTip(object):
         self.stay_open_range = 25
         "How much pixels the cursor can move away from the tooltip before it closes, when it's independent."
 
-        # Bind the motion event to close the tooltip if the cursor is too far away
-        self.widget.bind("<Motion>", self.motion, add="+")
+        self.motion_bind = None
+        "The id of the motion event binding, when the tooltip is independent. None when not bound."
 
     def showtip(self, text,  x: int, y: int, sug: list[tuple[str, typing.Callable]]=[]):
         "Display text in tooltip window"
@@ -548,6 +826,14 @@ class ToolTip(object):
             self.tipwindow = None
         self.independent = False
 
+        if self.motion_bind is not None:
+            # Remove our motion binding only. (widget.unbind would remove the other ones too
+            # on older Python versions!)
+            script = self.widget.bind("<Motion>")
+            self.widget.bind("<Motion>", "\n".join(l for l in script.split("\n") if self.motion_bind not in l))
+            self.widget.deletecommand(self.motion_bind)
+            self.motion_bind = None
+
     def motion(self, event):
         # The cursor has moved, see if we should close the tool tip
         if self.independent and self.tipwindow:
@@ -559,6 +845,10 @@ class ToolTip(object):
         # we'll close it.
         if self.tipwindow:
             self.independent = True
+            # Bind the motion event to close the tooltip if the cursor is too far away.
+            # It's only bound while we're independent, so we don't get called on every motion otherwise.
+            if self.motion_bind is None:
+                self.motion_bind = self.widget.bind("<Motion>", self.motion, add="+")
             self.close_if_cursor_too_far()
 
     def close_if_cursor_too_far(self):
@@ -575,37 +865,362 @@ class ToolTip(object):
         if local_x < -b or local_x > my_width + b or local_y < -b or local_y > my_height + b:
             self.destroy()
 
-# Temporary functions to profile the perf of highlighting updates
-import time
-import os
-ENABLE_PROFILING = os.getenv("DRAWPP_PROFILE", "0") == "1"
-def profile(name, func):
-    if not ENABLE_PROFILING:
-        return func()
-
-    start_time = time.perf_counter_ns()
-    res = func()
-    end_time = time.perf_counter_ns()
-
-    elapsed_time_ms = (end_time - start_time) / 1_000_000
-    print(f"{name}: {elapsed_time_ms} ms")
-    return res
-
-def profile_start(name):
-    if not ENABLE_PROFILING:
-        return 0
-
-    start_time = time.perf_counter_ns()
-    print(f"{name}: ", end="")
-    return start_time
-
-def profile_end(start_time):
-    if not ENABLE_PROFILING:
-        return
-
-    end_time = time.perf_counter_ns()
-    elapsed_time_ms = (end_time - start_time) / 1_000_000
-    print(f"{elapsed_time_ms} ms")
+class HighlightResult:
+    """
+    What analyse_highlighting found in the code, ready to be applied on the textbox.
+    All positions are tkinter "line.column" indices.
+    """
+
+    __slots__ = ("dirty", "spans", "todo")
+
+    def __init__(self, dirty: tuple[str, str] | None, spans: dict[str, list[str]], todo: list[str]):
+        self.dirty = dirty
+        "The (start, end) range of text where syntax highlighting must be cleared, None if nothing changed."
+        self.spans = spans
+        "The [start1, end1, start2, end2, ...] indices of the text to highlight with each tag."
+        self.todo = todo
+        "The [start1, end1, start2, end2, ...] indices of the text left to highlight, once it's visible."
+
+
+def analyse_highlighting(txt: ctk.CTkTextbox, code_text: str, todo: list[str], visible: tuple[int, int],
+                         epoch: int, applied_epoch: int) -> HighlightResult:
+    """
+    Runs the tokenizer on the code of a textbox, to find what to highlight.
+    Only the visible lines are highlighted: other text to highlight is returned in the todo list.
+
+    This runs on the highlighting thread, so it must NOT use tkinter at all!
+    It only uses the attributes of the textbox that are private to this thread: drawpp_text, drawpp_tokens,
+    drawpp_dirty and drawpp_hl_analysed.
+
+    :param txt: the textbox
+    :param code_text: the text of the textbox
+    :param todo: the [start1, end1, start2, end2, ...] indices of the text left to highlight
+    :param visible: the first and last visible lines
+    :param epoch: the number of this update
+    :param applied_epoch: the number of the last update applied on the textbox
+    """
+
+    line_starts = find_line_starts(code_text)
+    tidx_to_tkidx = tkidx_converter(line_starts)
+
+    # If the last update we analysed has been applied, its modified text has been highlighted already.
+    # Else, it was outdated, and we need to highlight its modified text along with ours.
+    dirty = txt.drawpp_dirty if txt.drawpp_hl_analysed != applied_epoch else None
+
+    # Run the tokenizer (for primary syntax highlighting).
+    # If we have the tokens of the previous text, only tokenize the modified part again:
+    # tkn_list[first:end] are the new tokens, all others are the same as before.
+    if txt.drawpp_tokens is None:
+        tkn_list = profile("tokenize", tokenize, code_text)
+        first, end = 0, len(tkn_list)
+    else:
+        tkn_list, first, end = profile("tokenize", retokenize, code_text, txt.drawpp_text, txt.drawpp_tokens)
+
+    if first != end:
+        lo, hi = tkn_list[first].offset, tkn_list[end - 1].end_offset
+        if dirty is not None:
+            # Move the old modified range to the new text coordinates, and merge it with ours.
+            # The old text in [lo; hi - delta[ is now the [lo; hi[ range of the new text.
+            delta = len(code_text) - len(txt.drawpp_text)
+            d_lo, d_hi = dirty
+            d_lo = d_lo if d_lo <= lo else d_lo + delta if d_lo >= hi - delta else lo
+            d_hi = d_hi if d_hi <= lo else d_hi + delta if d_hi >= hi - delta else hi
+            lo, hi = min(lo, d_lo), max(hi, d_hi)
+        dirty = lo, hi
+
+    txt.drawpp_text, txt.drawpp_tokens = code_text, tkn_list
+    txt.drawpp_dirty, txt.drawpp_hl_analysed = dirty, epoch
+
+    # Also highlight the text left to highlight. Inserted text is in there: it may have wrong tags
+    # (tkinter gives it the tags around it), even when it turns out to be the same as before.
+    # That happens when text is deleted, and then typed again.
+    for k in range(0, len(todo), 2):
+        (l1, c1), (l2, c2) = map(int, todo[k].split(".")), map(int, todo[k + 1].split("."))
+        a, b = line_starts[l1 - 1] + c1, line_starts[l2 - 1] + c2
+        dirty = (a, b) if dirty is None else (min(dirty[0], a), max(dirty[1], b))
+
+    # Only highlight the visible part of that text, and leave the rest for later.
+    new_todo = []
+    if dirty is not None:
+        v_lo = line_starts[visible[0] - 1]
+        v_hi = line_starts[visible[1]] if visible[1] < len(line_starts) else len(code_text)
+        lo, hi = dirty
+        if lo < v_lo:
+            new_todo += tidx_to_tkidx(lo), tidx_to_tkidx(min(hi, v_lo))
+        if hi > v_hi:
+            new_todo += tidx_to_tkidx(max(lo, v_hi)), tidx_to_tkidx(hi)
+        dirty = (max(lo, v_lo), min(hi, v_hi)) if lo < v_hi and hi > v_lo else None
+
+    # Gather the (start, end) indices of all text to highlight within the visible modified range, for each tag.
+    # Then, each tag can be added in one go: calling tkinter once per token is slow!
+    s = profile_start("highlighting (analysis)")
+    spans = {"kw": [], "str": [], "num": [], "cmt": []}
+    if dirty is not None:
+        lo, hi = dirty
+        i, j = bisect_right(tkn_list, lo, key=lambda t: t.offset) - 1, bisect_left(tkn_list, hi, key=lambda t: t.offset)
+        for t in tkn_list[max(i, 0):j]:
+            # First look at auxiliary text to highlight comments.
+            # It's whitespace most of the time: don't go through it when there's no comment at all.
+            if t.pre_auxiliary and "//" in t.full_text:
+                start = t.offset
+                for a in t.pre_auxiliary:
+                    l = len(a.text)
+                    if a.kind == AuxiliaryKind.SINGLE_LINE_COMMENT:
+                        # Comment
+                        spans["cmt"] += tidx_to_tkidx(start), tidx_to_tkidx(start + l)
+                    start += l
+
+            # Keyword, string or number? The tokenizer tells us the right tag.
+            # The token's text is at the very end of its full text, right before end_offset.
+            tag = t.kind.hl_class
+            if tag is not None:
+                spans[tag] += tidx_to_tkidx(t.end_offset - len(t.text)), tidx_to_tkidx(t.end_offset)
+
+        dirty = tidx_to_tkidx(lo), tidx_to_tkidx(hi)
+    profile_end(s)
+
+    return HighlightResult(dirty, spans, new_todo)
+
+
+def analyse_errors(txt: ctk.CTkTextbox, code_text: str) -> list[tuple[str, str, Problem]]:
+    """
+    Runs the parser and the semantic analysis on the code of a textbox, to find the errors to underline.
+    Returns the (start, end, problem) of each error, with tkinter indices.
+
+    This runs on the highlighting thread too, most of the time right after the highlighting update of the same text:
+    then, we can use its tokens.
+    """
+    # Same text as last time? Then we have the same errors. They still have to be underlined again,
+    # since editing the text may have removed some tags.
+    if code_text == txt.drawpp_err_text:
+        return txt.drawpp_errors
+
+    if code_text == txt.drawpp_text:
+        tkn_list = txt.drawpp_tokens
+    else:
+        tkn_list = profile("tokenize", tokenize, code_text)
+
+    tidx_to_tkidx = tkidx_converter(find_line_starts(code_text))
+
+    # Now, let's parse the tree to find any errors; and do semantic analysis for bonus errors
+    # Statements before the modified tokens are reused from the last time we parsed this textbox.
+    tree, txt.drawpp_parse_state = profile("parse", parse_resume, tkn_list, txt.drawpp_parse_state)
+    semantic = profile("semantic", analyse, tree)
+
+    s = profile_start("error finding")
+    ps = txt.drawpp_problems
+    ps.clear()
+    # Collect all errors from the tree, and put them all in the problem set.
+    # Only errors are shown, so don't bother with warnings.
+    collect_errors(tree, ps, True, semantic, ProblemSeverity.ERROR)
+    errors = []
+    for e in ps.grouped[ProblemSeverity.ERROR]:
+        # When the span is of zero-length, extend it on the right by one character to indicate something
+        # that is "missing".
+        ps, pe = e.pos.start, e.pos.end
+        if ps == pe:
+            if pe < len(code_text) and code_text[pe] != "\n":
+                pe = pe + 1
+            else:
+                # Tkinter doesn't support highlighting at the very end of line.
+                # So, in this case, let's just extend to the left.
+                ps = ps - 1
+
+        # Convert coordinates to tkinter coordinates
+        errors.append((tidx_to_tkidx(ps), tidx_to_tkidx(pe), e))
+    profile_end(s)
+
+    txt.drawpp_err_text, txt.drawpp_errors = code_text, errors
+    return errors
+
+
+def forget_analysis(txt: ctk.CTkTextbox):
+    """
+    Drops the data kept by analyse_highlighting and analyse_errors, for a textbox that won't be analysed again.
+    Must run on the highlighting thread.
+    """
+    txt.drawpp_text = txt.drawpp_tokens = txt.drawpp_dirty = None
+    txt.drawpp_parse_state = txt.drawpp_err_text = txt.drawpp_errors = None
+    txt.drawpp_problems = None
+
+
+def replace_text(txt: ctk.CTkTextbox, new_text: str):
+    """
+    Replaces the entire text of the textbox with new_text, by only replacing the part that differs.
+    """
+    old_text = get_code(txt)
+
+    # Find the text that's the same at the start and at the end of both texts: what's between is modified.
+    start = common_prefix_length(old_text, new_text)
+    end = common_suffix_length(old_text, new_text, min(len(old_text), len(new_text)) - start)
+
+    tidx_to_tkidx = tkidx_converter(find_line_starts(old_text))
+    first, last = tidx_to_tkidx(start), tidx_to_tkidx(len(old_text) - end)
+    if first != last:
+        txt.delete(first, last)
+    if start < len(new_text) - end:
+        txt.insert(first, new_text[start:len(new_text) - end])
+
+
+def get_code(txt: ctk.CTkTextbox) -> str:
+    """
+    Returns the entire text of the textbox, like txt.get("1.0", "end") does.
+    The text is only read from tkinter again when it has been edited since the last time
+    (see track_insertions): it's a copy of the whole text, and it's needed for each update.
+    """
+    if txt.drawpp_code_edits != txt.drawpp_edits:
+        txt.drawpp_code = txt.get("1.0", "end")
+        txt.drawpp_code_edits = txt.drawpp_edits
+    return txt.drawpp_code
+
+
+def find_code_font_family() -> str:
+    """
+    Finds the monospace font family to use for code.
+    Try all monospace fonts I know so it works on both Windows and Linux.
+    """
+    fonts = font.families()
+    available = set(fonts)
+    return next((f for f in MONOSPACE_FONTS if f in available), fonts[0])
+
+
+def find_line_starts(code_text: str) -> list[int]:
+    """
+    Finds the index where each line begins, to convert string indices into "line.column" coordinates.
+    (Using "1.0+{idx}c" coordinates is way slower: tkinter needs to count characters from the start!)
+    """
+    # Each line begins right after the previous one and its "\n": add up the lengths of all lines, plus one.
+    # This is done on the entire text on each update, so let split/map/accumulate do the loop (in C).
+    line_starts = list(accumulate(map((1).__add__, map(len, code_text.split("\n"))), initial=0))
+    line_starts.pop()  # That's where the line after the last one would begin.
+    return line_starts
+
+
+def tkidx_converter(line_starts: list[int]) -> typing.Callable[[int], str]:
+    """
+    Returns a function converting string indices into tkinter coordinates, using the line starts
+    given by find_line_starts.
+    """
+    # Tokens are sorted, so most indices are on the same line as the previous one:
+    # check that line first before searching through all lines.
+    prev_line = 0
+    def tidx_to_tkidx(idx):
+        nonlocal prev_line
+        line = prev_line
+        if idx < line_starts[line] or (line + 1 < len(line_starts) and idx >= line_starts[line + 1]):
+            line = prev_line = bisect_right(line_starts, idx) - 1
+        return f"{line + 1}.{idx - line_starts[line]}"
+    return tidx_to_tkidx
+
+
+def add_tag(txt: ctk.CTkTextbox, tag: str, indices: list[str]):
+    """
+    Adds a tag to many ranges of text at once, with indices being [start1, end1, start2, end2, ...].
+    Way faster than calling tag_add for each range, since we only call tkinter once.
+    """
+    if indices:
+        # CTkTextbox.tag_add only takes one range, so call the Tcl command of the widget directly.
+        # Use the original one: ours (see track_insertions) would only pass the call along.
+        txt.tk.call(txt.drawpp_tk_command, "tag", "add", tag, *indices)
+
+def remove_tag(txt: ctk.CTkTextbox, tag: str, start: str, end: str):
+    """
+    Removes a tag from a range of text, like tag_remove does, without going through tkinter and our
+    Tcl command (see add_tag).
+    """
+    txt.tk.call(txt.drawpp_tk_command, "tag", "remove", tag, start, end)
+
+def visible_lines(txt: ctk.CTkTextbox) -> tuple[int, int]:
+    """
+    Returns the first and last lines visible in the textbox, even partially.
+    """
+    first = txt.index("@0,0")
+    last = txt.index(f"@0,{txt._textbox.winfo_height()}")
+    return int(first.split(".")[0]), int(last.split(".")[0])
+
+
+def track_insertions(txt: ctk.CTkTextbox) -> str:
+    """
+    Adds the "hl_todo" tag to all text inserted in the textbox, be it typed, pasted, or inserted by code.
+
+    Tkinter gives inserted text the tags present on both sides of it, so its highlighting can be wrong,
+    and comparing the old and new text doesn't always tell us where text has been inserted.
+    To know it, we replace the Tcl command of the text widget with our own, which calls the original one
+    and then tags the inserted text. (That's how IDLE does it too!)
+    It also counts all edits in the drawpp_edits attribute of the textbox, so we know when the text has changed.
+    Returns the new name of the original command.
+    """
+    w = txt._textbox
+    orig = w._w + "_orig"
+    w.tk.call("rename", w._w, orig)
+
+    def command(*args):
+        try:
+            if args[0] not in ("insert", "replace"):
+                result = w.tk.call((orig,) + args)
+                if args[0] == "delete" or args[:2] in (("edit", "undo"), ("edit", "redo")):
+                    txt.drawpp_edits += 1
+                return result
+
+            # Put two marks where the text goes. The left one stays before the inserted text,
+            # and the right one moves after it.
+            # Text inserted at the end actually goes before the last newline, put the marks there.
+            index = w.tk.call(orig, "index", args[1])
+            if w.tk.getboolean(w.tk.call(orig, "compare", index, "==", "end")):
+                index = w.tk.call(orig, "index", "end-1c")
+            w.tk.call(orig, "mark", "set", "hl_insert_start", index)
+            w.tk.call(orig, "mark", "gravity", "hl_insert_start", "left")
+            w.tk.call(orig, "mark", "set", "hl_insert_end", index)
+
+            result = w.tk.call((orig,) + args)
+            txt.drawpp_edits += 1
+            w.tk.call(orig, "tag", "add", "hl_todo", "hl_insert_start", "hl_insert_end")
+            return result
+        except TclError:
+            # Errors can't go through our command (tkinter would raise them later in mainloop),
+            # and Tk's own code expects some commands to fail quietly, like deleting a missing selection.
+            return ""
+
+    w.tk.createcommand(w._w, command)
+    return orig
+
+def untrack_insertions(txt: ctk.CTkTextbox):
+    """
+    Removes the command added by track_insertions, and gives the original command its name back.
+    """
+    w = txt._textbox
+    w.tk.deletecommand(w._w)
+    w.tk.call("rename", txt.drawpp_tk_command, w._w)
+
+
+# Temporary functions to profile the perf of highlighting updates.
+# They log on the "pydpp.ide" logger, and do nothing at all unless ENABLE_PROFILING is set:
+# then, they're replaced with functions doing as little as possible, since they're called on each update.
+if ENABLE_PROFILING:
+    def profile(name, func, *args):
+        start_time = time.perf_counter_ns()
+        res = func(*args)
+        end_time = time.perf_counter_ns()
+
+        log.debug("%s: %s ms", name, (end_time - start_time) / 1_000_000)
+        return res
+
+    def profile_start(name):
+        return name, time.perf_counter_ns()
+
+    def profile_end(started):
+        name, start_time = started
+        end_time = time.perf_counter_ns()
+        log.debug("%s: %s ms", name, (end_time - start_time) / 1_000_000)
+else:
+    def profile(name, func, *args):
+        return func(*args)
+
+    def profile_start(name):
+        return None
+
+    def profile_end(started):
+        pass
 
 if __name__ == "__main__":
     app = App()
@@ -86,8 +86,10 @@ if not has_compiled_sdl_encap:
 # Well we're going to run the IDE here no surprise
 
 if find_spec("customtkinter") is not None:
-    # We are already in the venv, since we have customtkinter. Run the IDE.
-    subprocess.run([python_exe, "-m", "pydpp.ide"])
+    # We are already in the venv, since we have customtkinter. Run the IDE right here,
+    # no need to start another python process.
+    import runpy
+    runpy.run_module("pydpp.ide", run_name="__main__", alter_sys=True)
 elif find_spec("pipenv") is not None and (len(sys.argv) <= 1 or sys.argv[1] != "--no-pipenv"):
     # We have pipenv installed.
 